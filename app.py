@@ -1,142 +1,658 @@
 import os
-import json
-import re
-from openai import OpenAI
+import string
+import asyncio
+import contextlib
+import hashlib
+import logging
+import threading
+import time
+from typing import NamedTuple
+import diskcache
+import httpx
+import numpy as np
+import orjson
+import pandas as pd
+import tiktoken
+from openai import AsyncOpenAI, OpenAI, RateLimitError
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
 import streamlit as st
+from partial_json import parse_partial_json
+from single_flight import SingleFlight
+from token_bucket import TokenBucket
 
-# Instantiate the new client once
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-def call_openai(prompt: str, model="gpt-4o-mini") -> str:
-    if not client.api_key:
-        st.error("🔑 OPENAI_API_KEY not set!")
-        st.stop()
-    resp = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": "You are a strategic business consultant with expertise in growth strategies."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.3,
-        max_tokens=1500,
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = "You are a strategic business consultant with expertise in growth strategies."
+
+# Static prompt text is kept free of interpolation so every request shares a
+# byte-identical prefix that OpenAI's prompt caching can reuse
+SELF_DISCOVER_SYSTEM_PROMPT = """
+You are a strategic growth consultant applying the SELF-DISCOVER framework to complex business challenges.
+Your role is to deliver actionable, high-value strategic insights.
+
+## Instructions: Apply the following 3-stage reasoning process:
+### 1. SELECT 
+From this list of strategic growth modules, select the most relevant ones for solving this business challenge:
+- Break down into sub-tasks
+- Evaluate unit economics
+- Use systems thinking
+- Analyse competitor positioning
+- Identify pricing inefficiencies
+- Spot underused growth loops
+- Model conversion bottlenecks
+- Explore localisation opportunities
+- Prioritise by impact × feasibility
+- Conduct dynamic SWOT analysis
+
+### 2. ADAPT 
+Rephrase each selected module into a specific step for this business challenge.
+
+### 3. IMPLEMENT 
+Analyze the challenge using your adapted framework to:
+- Generate 5 specific, actionable strategic opportunities
+- Score each on Impact (1-5) and Feasibility (1-5)
+- Prioritize based on combined score
+
+The user message gives the company context, any priority focus areas and the challenge.
+"""
+
+DOSSIER_SYSTEM_PROMPT = SYSTEM_PROMPT + """
+
+Build an action dossier for the strategic action and industry given by the user.
+
+The dossier has two parts:
+
+1. "implementation": a detailed 30-60-90 day implementation plan including
+   specific milestones for each time period (30, 60, and 90 days), key metrics
+   to track success, required resources and estimated costs, potential
+   challenges with mitigation strategies, and a 12-month ROI projection.
+
+2. "competitive": a brief competitive analysis focusing on what leading competitors
+   are doing in this area, market benchmarks and best practices, and potential
+   competitive advantages.
+"""
+
+# Dynamic user messages, kept next to the system prompts they pair with
+SELF_DISCOVER_USER_TMPL = string.Template("""## Context
+Company: $company_name (Industry: $industry, Size: $company_size)
+
+$focus_areas_text
+
+## Challenge:
+$task
+""")
+
+DOSSIER_USER_TMPL = string.Template("""Industry: $industry
+
+Strategic action:
+$selected_action
+""")
+
+# Deterministic sampling so identical prompts produce identical (cacheable) answers
+TEMPERATURE = 0
+SEED = 42
+# Sidebar "Creative mode" trades reproducibility (and caching) for more varied ideas
+CREATIVE_TEMPERATURE = 0.7
+
+# Follow-up analyses always run on the fast model regardless of the sidebar choice
+FOLLOWUP_MODEL = "gpt-4o-mini"
+# Models that accept response_format={"type": "json_schema"}; others get a forced tool call
+STRUCTURED_OUTPUT_MODELS = {"gpt-4o-mini", "gpt-4o"}
+
+# Output budgets sized to each schema; decode time grows with every generated token
+SELF_DISCOVER_MAX_TOKENS = 800
+IMPLEMENTATION_MAX_TOKENS = 2000  # 9 milestones plus metrics, resources and challenges
+ROI_MAX_TOKENS = 60  # 12 floats
+COMPETITIVE_MAX_TOKENS = 600
+DOSSIER_MAX_TOKENS = IMPLEMENTATION_MAX_TOKENS + ROI_MAX_TOKENS + COMPETITIVE_MAX_TOKENS
+
+# Context window shared by gpt-4o, gpt-4o-mini and gpt-4-turbo
+MODEL_CONTEXT_TOKENS = 128_000
+PROMPT_TOKEN_MARGIN = 100  # per-message framing tokens the API adds
+
+# Persistent response cache shared by every session and surviving restarts;
+# point LLM_CACHE_DIR at a mounted volume to keep it across redeploys too
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "./.llm_cache")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(24 * 60 * 60)))  # seconds
+
+# Opt-in near-duplicate cache: reuse a response whose user message embeds at
+# least this close (cosine) to the new one, e.g. 0.95. Off by default because
+# prompts differing only in a company or action name embed almost identically
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0"))
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Entries kept per scope; the oldest is evicted once full
+SEMANTIC_CACHE_MAX_ENTRIES = 1000
+EMBEDDING_MAX_TOKENS = 8191  # longer inputs are rejected, so skip the semantic cache
+
+# Rating glyphs indexed by the 1-5 impact / feasibility score
+STARS = ["", "⭐", "⭐⭐", "⭐⭐⭐", "⭐⭐⭐⭐", "⭐⭐⭐⭐⭐"]
+CYCLES = ["", "🔄", "🔄🔄", "🔄🔄🔄", "🔄🔄🔄🔄", "🔄🔄🔄🔄🔄"]
+
+# Minimum delay between partial re-renders while a response streams in
+STREAM_RENDER_INTERVAL = 0.25  # seconds
+
+# HTTP/2 multiplexes concurrent requests over one pooled, kept-alive connection
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=32)
+HTTP_TIMEOUT = 60.0  # seconds
+
+# Client-side pacing kept just under the account's OpenAI rate limits
+MAX_REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_MAX_REQUESTS_PER_MINUTE", "500"))
+MAX_TOKENS_PER_MINUTE = float(os.getenv("OPENAI_MAX_TOKENS_PER_MINUTE", "200000"))
+RATE_LIMIT_PENALTY = 60  # seconds at half rate after a 429
+# Cap on requests in flight on the shared event loop, across all sessions
+MAX_CONCURRENT_REQUESTS = int(os.getenv("OPENAI_MAX_CONCURRENT_REQUESTS", "10"))
+
+# ── Response schemas ──────────────────────────────────────────────────────────
+class StrictModel(BaseModel):
+    # Structured outputs require every object to forbid undeclared keys
+    model_config = ConfigDict(extra="forbid")
+
+class AdaptedStep(StrictModel):
+    step: str
+    description: str
+
+class PrioritizedAction(StrictModel):
+    action: str
+    impact: int = Field(ge=1, le=5)
+    feasibility: int = Field(ge=1, le=5)
+
+class SelfDiscoverResult(StrictModel):
+    selected_modules: list[str]
+    adapted_structure: list[AdaptedStep]
+    opportunity_gaps: list[str]
+    prioritized_actions: list[PrioritizedAction]
+
+class Milestone(StrictModel):
+    milestone: str
+    details: str
+    metrics: str
+
+class SuccessMetric(StrictModel):
+    metric: str
+    target: str
+    tracking_method: str
+
+class ResourceRequirement(StrictModel):
+    resource: str
+    purpose: str
+    estimated_cost: str
+
+class Challenge(StrictModel):
+    challenge: str
+    mitigation_strategy: str
+
+class ImplementationPlan(StrictModel):
+    thirty_day_plan: list[Milestone]
+    sixty_day_plan: list[Milestone]
+    ninety_day_plan: list[Milestone]
+    success_metrics: list[SuccessMetric]
+    resources_required: list[ResourceRequirement]
+    potential_challenges: list[Challenge]
+    # One value per month; the length is enforced while decoding, not after
+    roi_projection: list[float] = Field(
+        min_length=12, max_length=12,
+        description="Estimated percentage revenue increase for each of the next 12 months",
     )
-    return resp.choices[0].message.content.strip()
 
-def generate_implementation_plan(data, selected_action):
-    prompt = f"""
-    Create a detailed 30-60-90 day implementation plan for this strategic action:
-    
-    {selected_action}
-    
-    The plan should include:
-    1. Specific milestones for each time period (30, 60, and 90 days)
-    2. Key metrics to track success
-    3. Required resources and estimated costs
-    4. Potential challenges and mitigation strategies
-    
-    Return as a structured JSON object with these exact keys:
-    - "thirty_day_plan": [list of objects with "milestone", "details", "metrics" keys]
-    - "sixty_day_plan": [list of objects with "milestone", "details", "metrics" keys]
-    - "ninety_day_plan": [list of objects with "milestone", "details", "metrics" keys]
-    - "success_metrics": [list of objects with "metric", "target", "tracking_method" keys]
-    - "resources_required": [list of objects with "resource", "purpose", "estimated_cost" keys]
-    - "potential_challenges": [list of objects with "challenge", "mitigation_strategy" keys]
-    
-    Return only valid JSON without any code block markers or additional text.
+class CompetitorApproach(StrictModel):
+    competitor: str
+    approach: str
+    effectiveness: str
+
+class CompetitiveAnalysis(StrictModel):
+    competitor_approaches: list[CompetitorApproach]
+    market_benchmarks: list[str]
+    competitive_advantage_opportunities: list[str]
+
+class ActionDossier(StrictModel):
+    implementation: ImplementationPlan
+    competitive: CompetitiveAnalysis
+
+def output_format_for(schema: type[BaseModel], model: str) -> dict:
+    """Request parameters that make ``model`` answer with ``schema``-shaped JSON.
+
+    The schema travels with the request rather than as prose in the prompt, so
+    models without structured outputs are forced to call a single function
+    whose parameters are the schema.
     """
-    
-    response = call_openai(prompt)
-    
-    # Clean the response
-    cleaned_response = response
-    if cleaned_response.startswith("```json"):
-        cleaned_response = cleaned_response.replace("```json", "", 1)
-    if cleaned_response.endswith("```"):
-        cleaned_response = cleaned_response[:-3]
-    cleaned_response = cleaned_response.strip()
-    
+    if model not in STRUCTURED_OUTPUT_MODELS:
+        return {
+            "tools": [{
+                "type": "function",
+                "function": {"name": schema.__name__, "parameters": schema.model_json_schema()},
+            }],
+            "tool_choice": {"type": "function", "function": {"name": schema.__name__}},
+        }
+    return {
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": {
+                "name": schema.__name__,
+                "schema": schema.model_json_schema(),
+                "strict": True,
+            },
+        },
+    }
+
+def extract_json(text: str) -> str:
+    # Slice from the first "{" to the last "}" to drop code fences or prose some
+    # models wrap around the object: two C-level scans, no regex backtracking
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        return text.strip()
+    return text[start:end + 1]
+
+def parse_response(schema: type[BaseModel], content: str) -> dict | None:
     try:
-        implementation_data = json.loads(cleaned_response)
-        return implementation_data
-    except json.JSONDecodeError:
-        st.warning("⚠️ Implementation plan response wasn't valid JSON.")
+        return schema.model_validate_json(content).model_dump()
+    except ValidationError:
+        pass
+    # Safety net for models without JSON mode that still wrap the object in prose
+    try:
+        return schema.model_validate_json(extract_json(content)).model_dump()
+    except ValidationError:
         return None
 
-def calculate_roi_projection(action_data):
-    prompt = f"""
-    Create a 12-month ROI projection for this strategic action:
-    
-    {action_data}
-    
-    Return only a JSON array of 12 monthly values representing estimated percentage increase in revenue.
-    Example: [1.5, 2.3, 3.1, 4.0, 5.2, 5.8, 6.5, 7.1, 7.5, 8.0, 8.3, 8.5]
-    Do not include any code block markers, explanation text, or anything other than the array itself.
+# ── OpenAI calls ──────────────────────────────────────────────────────────────
+@st.cache_resource(show_spinner=False)
+def get_llm_cache() -> diskcache.Cache:
+    return diskcache.Cache(LLM_CACHE_DIR)
+
+@st.cache_resource(show_spinner=False)
+def get_client() -> OpenAI:
+    # Streamlit re-executes this script on every interaction, so the client is
+    # cached as a resource to keep its connection pool warm between clicks
+    http_client = httpx.Client(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client)
+
+@st.cache_resource(show_spinner=False)
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    # Streamlit runs scripts without an event loop, and asyncio.run() would tear
+    # one down per click; a long-lived loop on a daemon thread lets the async
+    # client keep its TLS connections open across clicks and sessions
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="openai-event-loop", daemon=True).start()
+    return loop
+
+@st.cache_resource(show_spinner=False)
+def get_async_client() -> AsyncOpenAI:
+    # Only ever used on get_event_loop()'s loop, which its connection pool binds to
+    http_client = httpx.AsyncClient(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client)
+
+@st.cache_resource(show_spinner=False)
+def get_request_semaphore() -> asyncio.Semaphore:
+    return asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+def run_async(coro):
+    """Run ``coro`` on the shared background loop and block until it finishes."""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+@st.cache_resource(show_spinner=False)
+def get_rate_limiters() -> tuple[TokenBucket, TokenBucket]:
+    # Shared by every session in this process, since they share one API key
+    return TokenBucket(MAX_REQUESTS_PER_MINUTE), TokenBucket(MAX_TOKENS_PER_MINUTE)
+
+@st.cache_resource(show_spinner=False)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+def estimate_tokens(request: dict) -> int:
+    # OpenAI counts max_tokens against the TPM budget up front, so include it
+    encoding = get_encoding(request["model"])
+    prompt_tokens = sum(len(encoding.encode(m["content"])) for m in request["messages"])
+    return prompt_tokens + request["max_tokens"]
+
+def rate_limit_delay(request: dict) -> float:
+    requests_bucket, tokens_bucket = get_rate_limiters()
+    return max(requests_bucket.reserve(1), tokens_bucket.reserve(estimate_tokens(request)))
+
+@contextlib.contextmanager
+def penalize_on_rate_limit():
+    # A 429 means the client-side pacing was too optimistic, so slow it down
+    try:
+        yield
+    except RateLimitError:
+        for bucket in get_rate_limiters():
+            bucket.penalize(RATE_LIMIT_PENALTY)
+        raise
+
+@st.cache_resource(show_spinner=False)
+def get_single_flight() -> SingleFlight:
+    # Shared across sessions, so concurrent users asking the same thing also share
+    return SingleFlight()
+
+class SemanticCache:
+    """In-process nearest-neighbour lookup from prompt embeddings to responses.
+
+    Entries are partitioned by scope (the request minus its user message), so a
+    hit can only come from the same model, system prompt, schema and budget.
+    A brute-force dot product over unit vectors is plenty for a local cache.
+
+    Each scope holds at most SEMANTIC_CACHE_MAX_ENTRIES entries in a ring
+    buffer, so the oldest is overwritten once full. The vector matrix grows
+    by doubling, so inserts don't copy it every time.
     """
-    
-    response = call_openai(prompt)
-    
-    # Extract array from response using regex
-    match = re.search(r'\[[\d\., ]+\]', response)
-    if match:
-        array_str = match.group(0)
-        try:
-            roi_data = json.loads(array_str)
-            return roi_data
-        except json.JSONDecodeError:
-            return [0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0, 5.5, 6.0]  # Default fallback
+
+    def __init__(self):
+        self.vectors = {}
+        self.responses = {}
+        self.added = {}
+        self.lock = threading.Lock()
+
+    def lookup(self, scope: str, embedding: np.ndarray) -> str | None:
+        with self.lock:
+            if scope not in self.vectors:
+                return None
+            size = min(self.added[scope], SEMANTIC_CACHE_MAX_ENTRIES)
+            similarities = self.vectors[scope][:size] @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] < SEMANTIC_CACHE_THRESHOLD:
+                return None
+            return self.responses[scope][best]
+
+    def add(self, scope: str, embedding: np.ndarray, response: str):
+        with self.lock:
+            if scope not in self.vectors:
+                self.vectors[scope] = np.empty((16, embedding.shape[0]), dtype=np.float32)
+                self.responses[scope] = []
+                self.added[scope] = 0
+            vectors, responses = self.vectors[scope], self.responses[scope]
+            slot = self.added[scope] % SEMANTIC_CACHE_MAX_ENTRIES
+            if slot == len(vectors):
+                rows = min(2 * len(vectors), SEMANTIC_CACHE_MAX_ENTRIES)
+                grown = np.empty((rows, vectors.shape[1]), dtype=np.float32)
+                grown[:slot] = vectors
+                vectors = self.vectors[scope] = grown
+            vectors[slot] = embedding
+            if slot == len(responses):
+                responses.append(response)
+            else:
+                responses[slot] = response
+            self.added[scope] += 1
+
+@st.cache_resource(show_spinner=False)
+def get_semantic_cache() -> SemanticCache:
+    return SemanticCache()
+
+def may_exceed(text: str, limit: int) -> bool:
+    # A token spans at least one UTF-8 byte and a character at most four, so
+    # typical prompts can be ruled out without tokenizing them
+    return 4 * len(text) > limit
+
+def semantic_scope(request: dict) -> str | None:
+    if not SEMANTIC_CACHE_THRESHOLD:
+        return None
+    prompt = request["messages"][-1]["content"]
+    if may_exceed(prompt, EMBEDDING_MAX_TOKENS):
+        if len(get_encoding(EMBEDDING_MODEL).encode(prompt)) > EMBEDDING_MAX_TOKENS:
+            return None
+    return cache_key({**request, "messages": request["messages"][:-1]})
+
+def unit_vector(embedding_response) -> np.ndarray:
+    vector = np.asarray(embedding_response.data[0].embedding, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+def cache_key(request: dict) -> str | None:
+    """SHA-256 of the canonical JSON form of a chat completion request.
+
+    Returns None for sampled (temperature > 0) requests, whose answers are
+    not reproducible and so must not be served from the cache.
+    """
+    if request["temperature"] > 0:
+        return None
+    payload = orjson.dumps(request, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(payload).hexdigest()
+
+def fit_prompt(system: str, prompt: str, model: str, max_tokens: int) -> tuple[str, bool]:
+    """Cut the middle out of ``prompt`` if the request would overflow the context window.
+
+    A pasted challenge that is too long would otherwise be rejected with a 400
+    after a full round-trip. The start and end of the text are kept, since
+    that is usually where the context and the actual ask are. The flag
+    says whether anything was cut, so the user can be told.
+    """
+    budget = MODEL_CONTEXT_TOKENS - PROMPT_TOKEN_MARGIN - max_tokens
+    if not may_exceed(system + prompt, budget):
+        return prompt, False
+    encoding = get_encoding(model)
+    tokens = encoding.encode(prompt)
+    budget -= len(encoding.encode(system))
+    if len(tokens) <= budget:
+        return prompt, False
+    keep = max(budget, 0) // 2
+    trimmed = encoding.decode(tokens[:keep]) + "\n…\n" + encoding.decode(tokens[len(tokens) - keep:])
+    return trimmed, True
+
+def build_request(system: str, prompt: str, model: str, output_format: dict, max_tokens: int, temperature: float) -> dict:
+    # Static instructions go first and dynamic input last so OpenAI's automatic
+    # prompt caching can reuse the shared prefix across calls
+    request = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        **output_format,
+    }
+    if temperature == 0:
+        # A fixed seed would make sampled (Creative mode) reruns repeat themselves
+        request["seed"] = SEED
+    return request
+
+class Completion(NamedTuple):
+    content: str
+    finish_reason: str | None
+    completion_tokens: int | None = None  # None when served from a cache
+    prompt_truncated: bool = False  # fit_prompt cut the middle of the user message
+
+def stream_completion(request: dict, on_partial) -> Completion:
+    text = ""
+    finish_reason = completion_tokens = None
+    last_render = 0.0
+    stream = get_client().chat.completions.create(
+        **request, stream=True, stream_options={"include_usage": True}
+    )
+    for chunk in stream:
+        if chunk.usage:
+            # Sent in a final chunk with no choices
+            completion_tokens = chunk.usage.completion_tokens
+        if not chunk.choices:
+            continue
+        finish_reason = chunk.choices[0].finish_reason or finish_reason
+        delta = chunk.choices[0].delta
+        if delta.tool_calls:
+            # Forced tool calls stream their JSON as function-argument fragments
+            text += delta.tool_calls[0].function.arguments or ""
+        else:
+            text += delta.content or ""
+        
+        # Re-parsing on every token is wasteful; refresh the preview at most every 250ms
+        now = time.monotonic()
+        if on_partial is not None and now - last_render >= STREAM_RENDER_INTERVAL:
+            partial = parse_partial_json(text)
+            if partial is not None:
+                on_partial(partial)
+            last_render = now
+    return Completion(text.strip(), finish_reason, completion_tokens)
+
+class CompletionCall:
+    """Cache and rate-limit bookkeeping around one chat completion request.
+
+    call_openai and acall_openai differ only in how they reach the API
+    (streamed and blocking vs. awaited); the exact and semantic cache
+    lookups, the rate-limit reservation and the cache writes live here so
+    the two paths can't drift apart.
+    """
+
+    def __init__(self, system: str, prompt: str, model: str, output_format: dict, max_tokens: int, temperature: float):
+        # The user message as sent, i.e. after fit_prompt
+        self.prompt, self.prompt_truncated = fit_prompt(system, prompt, model, max_tokens)
+        self.request = build_request(system, self.prompt, model, output_format, max_tokens, temperature)
+        self.key = cache_key(self.request)
+        self.scope = semantic_scope(self.request) if self.key else None
+        self.embedding = None
+
+    def cached(self) -> Completion | None:
+        content = get_llm_cache().get(self.key) if self.key else None
+        # Only complete answers are ever cached
+        return None if content is None else Completion(content, "stop", prompt_truncated=self.prompt_truncated)
+
+    def similar(self, embedding_response) -> Completion | None:
+        self.embedding = unit_vector(embedding_response)
+        content = get_semantic_cache().lookup(self.scope, self.embedding)
+        return None if content is None else Completion(content, "stop", prompt_truncated=self.prompt_truncated)
+
+    def delay(self) -> float:
+        return rate_limit_delay(self.request)
+
+    def record(self, completion: Completion) -> Completion:
+        completion = completion._replace(prompt_truncated=self.prompt_truncated)
+        # Logged so the *_MAX_TOKENS budgets can be checked against real output
+        logger.info(
+            "%s used %s of %d completion tokens (finish_reason=%s)",
+            self.request["model"], completion.completion_tokens,
+            self.request["max_tokens"], completion.finish_reason,
+        )
+        if completion.finish_reason == "length":
+            # Cut off at max_tokens, so it can't be valid JSON; caching would replay the failure
+            return completion
+        if self.key:
+            get_llm_cache().set(self.key, completion.content, expire=LLM_CACHE_TTL)
+        if self.scope:
+            get_semantic_cache().add(self.scope, self.embedding, completion.content)
+        return completion
+
+async def await_completion(request: dict) -> Completion:
+    resp = await get_async_client().chat.completions.create(**request)
+    choice = resp.choices[0]
+    if choice.message.tool_calls:
+        content = choice.message.tool_calls[0].function.arguments
     else:
-        return [0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0, 5.5, 6.0]  # Default fallback
+        # A strict-schema refusal has no content; "" fails validation like any bad answer
+        content = choice.message.content or ""
+    return Completion(content.strip(), choice.finish_reason, resp.usage.completion_tokens)
 
-def generate_competitive_analysis(industry, opportunity):
-    prompt = f"""
-    Conduct a brief competitive analysis related to this opportunity in the {industry} industry:
-    
-    {opportunity}
+def call_openai(system: str, prompt: str, output_format: dict, max_tokens: int, model="gpt-4o-mini", temperature=TEMPERATURE, on_partial=None) -> Completion:
+    call = CompletionCall(system, prompt, model, output_format, max_tokens, temperature)
+    hit = call.cached()
+    if hit is None and call.scope:
+        hit = call.similar(get_client().embeddings.create(model=EMBEDDING_MODEL, input=call.prompt))
+    if hit is not None:
+        return hit
     
-    Focus on:
-    1. What leading competitors are doing in this area
-    2. Market benchmarks and best practices
-    3. Potential competitive advantages
+    def fetch() -> Completion:
+        # Runs once per flight, so only the leader paces itself and fills the caches.
+        # Re-check first: a previous flight may have landed since the lookup above
+        hit = call.cached()
+        if hit is not None:
+            return hit
+        time.sleep(call.delay())
+        with penalize_on_rate_limit():
+            # Stream so on_partial can show fields as they arrive instead of a blank spinner
+            completion = stream_completion(call.request, on_partial)
+        return call.record(completion)
     
-    Return as JSON with these exact keys:
-    - "competitor_approaches": [list of objects with "competitor", "approach", "effectiveness" keys]
-    - "market_benchmarks": [list of benchmark strings]
-    - "competitive_advantage_opportunities": [list of opportunity strings]
-    
-    Return only valid JSON without any code block markers or additional text.
-    """
+    return get_single_flight().do(call.key, fetch)
+
+async def acall_openai(system: str, prompt: str, output_format: dict, max_tokens: int, model=FOLLOWUP_MODEL, temperature=TEMPERATURE) -> Completion:
+    call = CompletionCall(system, prompt, model, output_format, max_tokens, temperature)
+    hit = call.cached()
+    if hit is None and call.scope:
+        hit = call.similar(await get_async_client().embeddings.create(model=EMBEDDING_MODEL, input=call.prompt))
+    if hit is not None:
+        return hit
     
-    response = call_openai(prompt)
+    async def fetch() -> Completion:
+        hit = call.cached()
+        if hit is not None:
+            return hit
+        await asyncio.sleep(call.delay())
+        with penalize_on_rate_limit():
+            async with get_request_semaphore():
+                completion = await await_completion(call.request)
+        return call.record(completion)
     
-    # Clean the response
-    cleaned_response = response
-    if cleaned_response.startswith("```json"):
-        cleaned_response = cleaned_response.replace("```json", "", 1)
-    if cleaned_response.endswith("```"):
-        cleaned_response = cleaned_response[:-3]
-    cleaned_response = cleaned_response.strip()
+    return await get_single_flight().ado(call.key, fetch)
+
+class InvalidResponse(ValueError):
+    """A response that failed schema validation; ``truncated`` if it hit max_tokens."""
+
+    def __init__(self, finish_reason: str | None):
+        super().__init__(f"response didn't match the expected schema (finish_reason={finish_reason})")
+        self.truncated = finish_reason == "length"
+
+def invalid_response_warning(name: str, truncated: bool) -> str:
+    if truncated:
+        return f"⚠️ {name} was cut off at its token limit before it was complete."
+    return f"⚠️ {name} didn't match the expected schema."
+
+def request_action_dossier(selected_action, industry, temperature) -> dict:
+    # One request covers all the follow-ups so the shared action context is
+    # sent (and billed) once and the user waits on a single round-trip;
+    # everything but the action itself is in DOSSIER_SYSTEM_PROMPT
+    prompt = DOSSIER_USER_TMPL.substitute(industry=industry, selected_action=selected_action)
     
+    completion = run_async(acall_openai(
+        DOSSIER_SYSTEM_PROMPT, prompt,
+        output_format_for(ActionDossier, FOLLOWUP_MODEL), DOSSIER_MAX_TOKENS,
+        temperature=temperature
+    ))
+    dossier = parse_response(ActionDossier, completion.content)
+    if dossier is None:
+        # Raised rather than returned: st.cache_data doesn't store exceptions,
+        # so cached_action_dossier retries a failure on the next click
+        raise InvalidResponse(completion.finish_reason)
+    return dossier
+
+def dossier_fingerprint() -> str:
+    # Hash of the request template (prompts, schema, model, budget), so any
+    # change to them invalidates memoized dossiers without a manual version bump
+    template = build_request(
+        DOSSIER_SYSTEM_PROMPT, DOSSIER_USER_TMPL.template, FOLLOWUP_MODEL,
+        output_format_for(ActionDossier, FOLLOWUP_MODEL), DOSSIER_MAX_TOKENS, TEMPERATURE
+    )
+    return cache_key(template)
+
+@st.cache_data(ttl=LLM_CACHE_TTL, show_spinner=False)
+def cached_action_dossier(selected_action, industry, fingerprint) -> dict:
+    # Memoizes the parsed dossier so revisiting an action skips both the disk
+    # cache and validation; fingerprint is only here to key the cache
+    return request_action_dossier(selected_action, industry, TEMPERATURE)
+
+def generate_action_dossier(data, selected_action, industry, temperature=TEMPERATURE):
     try:
-        analysis_data = json.loads(cleaned_response)
-        return analysis_data
-    except json.JSONDecodeError:
-        st.warning("⚠️ Competitive analysis response wasn't valid JSON.")
-        return None
+        if temperature > 0:
+            dossier = request_action_dossier(selected_action, industry, temperature)
+        else:
+            dossier = cached_action_dossier(selected_action, industry, dossier_fingerprint())
+    except InvalidResponse as exc:
+        st.warning(invalid_response_warning("Action dossier response", exc.truncated))
+        return None, None
+    return dossier["implementation"], dossier["competitive"]
+
+@st.cache_data(show_spinner=False)
+def actions_frame(actions: tuple) -> pd.DataFrame:
+    # Keyed on (action, impact, feasibility) tuples so reruns triggered by
+    # other widgets reuse the frame instead of rebuilding it
+    df = pd.DataFrame(actions, columns=["Action", "Impact", "Feasibility"])
+    df["Total Score"] = df["Impact"] + df["Feasibility"]
+    df["Impact"] = df["Impact"].map(lambda x: f"{STARS[x]} ({x}/5)")
+    df["Feasibility"] = df["Feasibility"].map(lambda x: f"{CYCLES[x]} ({x}/5)")
+    df.index = pd.RangeIndex(1, len(df) + 1, name="Priority")
+    return df
 
 # ── Streamlit UI ──────────────────────────────────────────────────────────────
 st.set_page_config(page_title="SELF-DISCOVER Growth Strategy Consultant", layout="wide")
 
 # Session state initialization
-if 'results' not in st.session_state:
-    st.session_state.results = None
-if 'implementation_plan' not in st.session_state:
-    st.session_state.implementation_plan = None
-if 'competitive_analysis' not in st.session_state:
-    st.session_state.competitive_analysis = None
-if 'selected_action' not in st.session_state:
-    st.session_state.selected_action = None
-if 'roi_data' not in st.session_state:
-    st.session_state.roi_data = None
+for key in ("results", "implementation_plan", "competitive_analysis", "selected_action"):
+    st.session_state.setdefault(key, None)
 
 # Header and intro
 st.title("🚀 SELF-DISCOVER Growth Strategy Consultant")
@@ -145,6 +661,12 @@ This AI-powered consultant helps you identify strategic growth opportunities and
 actionable implementation plans using the SELF-DISCOVER framework.
 """)
 
+# Checked once per run here rather than on every OpenAI call, and before any
+# client is built, since the OpenAI constructors raise without a key
+if not os.getenv("OPENAI_API_KEY"):
+    st.error("🔑 OPENAI_API_KEY not set!")
+    st.stop()
+
 # Sidebar for inputs
 with st.sidebar:
     st.header("Business Context")
@@ -160,6 +682,10 @@ with st.sidebar:
     model_choice = st.selectbox("AI Model", 
                               ["gpt-4o-mini", "gpt-4o", "gpt-4-turbo"], 
                               help="More advanced models may provide better results but can be slower")
+    
+    creative_mode = st.toggle("Creative mode",
+                              help="Sample more varied strategies. Results are no longer reproducible or cached")
+    temperature = CREATIVE_TEMPERATURE if creative_mode else TEMPERATURE
 
 # Main content area
 task_col1, task_col2 = st.columns([2, 1])
@@ -187,83 +713,36 @@ if run_button:
     if not task:
         st.error("Please enter a business challenge above.")
     else:
-        # 1. Build the enhanced 3-stage prompt
+        # 1. Build the dynamic part of the prompt; the 3-stage instructions live in
+        #    SELF_DISCOVER_SYSTEM_PROMPT so the cached prefix is byte-identical
         focus_areas_text = ""
         if focus_areas:
             focus_areas_text = "Focus especially on these priority areas: " + ", ".join(focus_areas)
-            
-        company_context = f"Company: {company_name} (Industry: {industry}, Size: {company_size})"
         
-        prompt = f"""
-You are a strategic growth consultant applying the SELF-DISCOVER framework to complex business challenges.
-Your role is to deliver actionable, high-value strategic insights.
-
-## Context
-{company_context}
-
-## Instructions: Apply the following 3-stage reasoning process:
-### 1. SELECT 
-From this list of strategic growth modules, select the most relevant ones for solving this business challenge:
-- Break down into sub-tasks
-- Evaluate unit economics
-- Use systems thinking
-- Analyse competitor positioning
-- Identify pricing inefficiencies
-- Spot underused growth loops
-- Model conversion bottlenecks
-- Explore localisation opportunities
-- Prioritise by impact × feasibility
-- Conduct dynamic SWOT analysis
-
-### 2. ADAPT 
-Rephrase each selected module into a specific step for this business challenge.
-
-### 3. IMPLEMENT 
-Analyze the challenge using your adapted framework to:
-- Generate 5 specific, actionable strategic opportunities
-- Score each on Impact (1-5) and Feasibility (1-5)
-- Prioritize based on combined score
-
-{focus_areas_text}
-
-## Challenge:
-{task}
-
-## Output Format:
-```json
-{{
-  "selected_modules": ["List of selected strategy modules"],
-  "adapted_structure": {{ "Step 1": "Description", "Step 2": "Description", ... }},
-  "opportunity_gaps": ["1. First specific opportunity", "2. Second opportunity", ...],
-  "prioritized_actions": [
-    {{ "action": "First priority action", "impact": X, "feasibility": Y }},
-    {{ "action": "Second priority action", "impact": X, "feasibility": Y }},
-    ...
-  ]
-}}
-```
-Return ONLY valid JSON without any additional text or explanations.
-"""
+        prompt = SELF_DISCOVER_USER_TMPL.substitute(
+            company_name=company_name, industry=industry, company_size=company_size,
+            focus_areas_text=focus_areas_text, task=task
+        )
         # 2. Call OpenAI with enhanced context
         with st.spinner("🤖 Analyzing your business challenge..."):
-            raw = call_openai(prompt, model=model_choice)
-        
-        # 3. Clean and parse results
-        cleaned_response = raw
-        # Remove markdown code blocks
-        if cleaned_response.startswith("```json"):
-            cleaned_response = cleaned_response.replace("```json", "", 1)
-        if cleaned_response.endswith("```"):
-            cleaned_response = cleaned_response[:-3]
-        cleaned_response = cleaned_response.strip()
+            preview = st.empty()
+            completion = call_openai(
+                SELF_DISCOVER_SYSTEM_PROMPT, prompt,
+                output_format_for(SelfDiscoverResult, model_choice), SELF_DISCOVER_MAX_TOKENS,
+                model=model_choice, temperature=temperature,
+                on_partial=preview.json
+            )
+            preview.empty()
         
-        try:
-            data = json.loads(cleaned_response)
-            st.session_state.results = data
-        except json.JSONDecodeError:
-            st.warning("⚠️ Response wasn't valid JSON — showing raw output:")
-            st.code(raw)
-            st.session_state.results = None
+        # 3. Validate results against the schema
+        if completion.prompt_truncated:
+            st.info("ℹ️ Your challenge description was too long for the model, so part of its middle was left out.")
+        data = parse_response(SelfDiscoverResult, completion.content)
+        if data is None:
+            truncated = completion.finish_reason == "length"
+            st.warning(invalid_response_warning("Response", truncated) + " Showing raw output:")
+            st.code(completion.content)
+        st.session_state.results = data
 
 # Display results if available
 if st.session_state.results:
@@ -280,47 +759,36 @@ if st.session_state.results:
         
         with col1:
             st.subheader("Selected Strategy Modules")
-            for i, module in enumerate(data["selected_modules"]):
-                st.markdown(f"**{i+1}.** {module}")
+            st.markdown("\n\n".join(
+                f"**{i+1}.** {module}" for i, module in enumerate(data["selected_modules"])
+            ))
         
         with col2:
             st.subheader("Adapted Growth Framework")
-            for step, description in data["adapted_structure"].items():
-                st.markdown(f"**{step}:** {description}")
+            st.markdown("\n\n".join(
+                f"**{step['step']}:** {step['description']}" for step in data["adapted_structure"]
+            ))
     
     with tabs[1]:
         st.header("Strategic Growth Opportunities")
         
         # Opportunity gaps
         st.subheader("Identified Opportunity Gaps")
-        for opportunity in data["opportunity_gaps"]:
-            st.markdown(f"• {opportunity}")
+        st.markdown("\n\n".join(f"• {opportunity}" for opportunity in data["opportunity_gaps"]))
         
         # Prioritized actions
         st.subheader("Prioritized Strategic Actions")
         
-        # Create a DataFrame for the prioritized actions
-        actions_data = []
-        for action in data["prioritized_actions"]:
-            actions_data.append({
-                "Action": action["action"],
-                "Impact": action["impact"],
-                "Feasibility": action["feasibility"],
-                "Total Score": action["impact"] + action["feasibility"]
-            })
-        
-        # Display prioritized actions in a table format
-        for i, action in enumerate(data["prioritized_actions"]):
-            impact = action["impact"]
-            feasibility = action["feasibility"]
-            total = impact + feasibility
-            
-            st.markdown(f"""
-            **Priority {i+1}: {action['action']}**
-            - Impact: {'⭐' * impact} ({impact}/5)
-            - Feasibility: {'🔄' * feasibility} ({feasibility}/5)
-            - Total Score: {total}/10
-            """)
+        actions = tuple(
+            (a["action"], a["impact"], a["feasibility"]) for a in data["prioritized_actions"]
+        )
+        st.dataframe(
+            actions_frame(actions),
+            use_container_width=True,
+            column_config={
+                "Total Score": st.column_config.NumberColumn(format="%d/10"),
+            },
+        )
         
         # Action selection for detailed planning
         st.subheader("Select an Action for Detailed Planning")
@@ -331,31 +799,22 @@ if st.session_state.results:
             st.session_state.selected_action = selected_action
             st.session_state.implementation_plan = None
             st.session_state.competitive_analysis = None
-            st.session_state.roi_data = None
-        
-        col1, col2 = st.columns(2)
         
-        with col1:
-            if st.button("Generate Implementation Plan", use_container_width=True):
-                with st.spinner("Creating detailed implementation plan..."):
-                    st.session_state.implementation_plan = generate_implementation_plan(
-                        data, selected_action
-                    )
-                    st.session_state.roi_data = calculate_roi_projection(selected_action)
-                    
-        with col2:
-            if st.button("Generate Competitive Analysis", use_container_width=True):
-                with st.spinner("Analyzing competitive landscape..."):
-                    st.session_state.competitive_analysis = generate_competitive_analysis(
-                        industry, selected_action
-                    )
+        if st.button("Generate Full Action Dossier", use_container_width=True):
+            with st.spinner("Building implementation plan, ROI projection and competitive analysis..."):
+                (
+                    st.session_state.implementation_plan,
+                    st.session_state.competitive_analysis,
+                ) = generate_action_dossier(data, selected_action, industry, temperature)
         
     with tabs[2]:
         st.header("Detailed Implementation Planning")
         
-        if st.session_state.implementation_plan:
-            plan = st.session_state.implementation_plan
-            
+        # Bind session state once; the renders below read these many times
+        plan = st.session_state.implementation_plan
+        analysis = st.session_state.competitive_analysis
+        
+        if plan:
             # Display 30-60-90 day plan in columns
             st.subheader("30-60-90 Day Implementation Plan")
             plan_col1, plan_col2, plan_col3 = st.columns(3)
@@ -364,40 +823,43 @@ if st.session_state.results:
                 st.markdown("### 30-Day Milestones")
                 for milestone in plan["thirty_day_plan"]:
                     with st.expander(milestone["milestone"]):
-                        st.markdown(f"**Details:** {milestone['details']}")
-                        st.markdown(f"**Metrics:** {milestone['metrics']}")
+                        st.markdown(
+                            f"**Details:** {milestone['details']}\n\n**Metrics:** {milestone['metrics']}"
+                        )
             
             with plan_col2:
                 st.markdown("### 60-Day Milestones")
                 for milestone in plan["sixty_day_plan"]:
                     with st.expander(milestone["milestone"]):
-                        st.markdown(f"**Details:** {milestone['details']}")
-                        st.markdown(f"**Metrics:** {milestone['metrics']}")
+                        st.markdown(
+                            f"**Details:** {milestone['details']}\n\n**Metrics:** {milestone['metrics']}"
+                        )
             
             with plan_col3:
                 st.markdown("### 90-Day Milestones")
                 for milestone in plan["ninety_day_plan"]:
                     with st.expander(milestone["milestone"]):
-                        st.markdown(f"**Details:** {milestone['details']}")
-                        st.markdown(f"**Metrics:** {milestone['metrics']}")
+                        st.markdown(
+                            f"**Details:** {milestone['details']}\n\n**Metrics:** {milestone['metrics']}"
+                        )
             
             # Success metrics
             st.subheader("Key Success Metrics")
-            for metric in plan["success_metrics"]:
-                st.markdown(f"""
-                **{metric['metric']}**
-                - Target: {metric['target']}
-                - Tracking Method: {metric['tracking_method']}
-                """)
+            st.markdown("\n\n".join(
+                f"**{metric['metric']}**\n"
+                f"- Target: {metric['target']}\n"
+                f"- Tracking Method: {metric['tracking_method']}"
+                for metric in plan["success_metrics"]
+            ))
             
             # Resources required
             st.subheader("Resources Required")
-            for resource in plan["resources_required"]:
-                st.markdown(f"""
-                **{resource['resource']}**
-                - Purpose: {resource['purpose']}
-                - Estimated Cost: {resource['estimated_cost']}
-                """)
+            st.markdown("\n\n".join(
+                f"**{resource['resource']}**\n"
+                f"- Purpose: {resource['purpose']}\n"
+                f"- Estimated Cost: {resource['estimated_cost']}"
+                for resource in plan["resources_required"]
+            ))
             
             # Challenges and mitigation
             st.subheader("Risk Management")
@@ -405,48 +867,45 @@ if st.session_state.results:
                 with st.expander(f"Challenge: {challenge['challenge']}"):
                     st.markdown(f"**Mitigation Strategy:** {challenge['mitigation_strategy']}")
             
-            # ROI Projection
-            if st.session_state.roi_data:
-                st.subheader("12-Month ROI Projection")
-                months = ["Month " + str(i+1) for i in range(12)]
-                
-                # Display ROI data in a readable format
-                st.markdown("### Projected Monthly Revenue Increase (%)")
-                roi_text = ""
-                for i, val in enumerate(st.session_state.roi_data):
-                    roi_text += f"**Month {i+1}:** +{val}%\n\n"
-                st.markdown(roi_text)
-                
-                # Calculate cumulative effect
-                cumulative = sum(st.session_state.roi_data)
-                st.success(f"**Estimated 12-Month Revenue Impact:** +{cumulative:.1f}%")
-        
-        if st.session_state.competitive_analysis:
-            analysis = st.session_state.competitive_analysis
+            # ROI Projection (always 12 months, enforced by the schema)
+            roi = np.asarray(plan["roi_projection"], dtype=np.float64)
+            cumulative = np.cumsum(roi)
+            st.subheader("12-Month ROI Projection")
+            roi_df = pd.DataFrame(
+                {"Uplift %": roi, "Cumulative %": cumulative},
+                index=pd.RangeIndex(1, roi.size + 1, name="Month"),
+            )
             
+            st.markdown("### Projected Monthly Revenue Increase (%)")
+            st.bar_chart(roi_df, y="Uplift %")
+            st.dataframe(roi_df.T, use_container_width=True)
+            
+            st.success(f"**Estimated 12-Month Revenue Impact:** +{cumulative[-1]:.1f}%")
+        
+        if analysis:
             st.subheader("Competitive Landscape Analysis")
             
             # Competitor approaches
             st.markdown("### Competitor Approaches")
-            for comp in analysis["competitor_approaches"]:
-                st.markdown(f"""
-                **{comp['competitor']}**
-                - Approach: {comp['approach']}
-                - Effectiveness: {comp['effectiveness']}
-                """)
+            st.markdown("\n\n".join(
+                f"**{comp['competitor']}**\n"
+                f"- Approach: {comp['approach']}\n"
+                f"- Effectiveness: {comp['effectiveness']}"
+                for comp in analysis["competitor_approaches"]
+            ))
             
             # Market benchmarks
             st.markdown("### Market Benchmarks")
-            for benchmark in analysis["market_benchmarks"]:
-                st.markdown(f"• {benchmark}")
+            st.markdown("\n\n".join(f"• {benchmark}" for benchmark in analysis["market_benchmarks"]))
             
             # Competitive advantages
             st.markdown("### Competitive Advantage Opportunities")
-            for advantage in analysis["competitive_advantage_opportunities"]:
-                st.markdown(f"• {advantage}")
+            st.markdown("\n\n".join(
+                f"• {advantage}" for advantage in analysis["competitive_advantage_opportunities"]
+            ))
         
-        if not st.session_state.implementation_plan and not st.session_state.competitive_analysis:
-            st.info("Select an action from the Opportunity Analysis tab and generate an implementation plan or competitive analysis to see detailed planning information.")
+        if not plan and not analysis:
+            st.info("Select an action from the Opportunity Analysis tab and generate a full action dossier to see detailed planning information.")
 
 # Footer with export option
 st.markdown("---")
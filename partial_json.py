@@ -0,0 +1,44 @@
+import orjson
+
+
+def parse_partial_json(text: str) -> dict | None:
+    """Best-effort parse of a truncated JSON document by closing open strings and brackets."""
+    start = text.find("{")
+    if start == -1:
+        return None
+    text = text[start:]
+
+    closers = []
+    in_string = escaped = False
+    escape_start = None
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+                # \uXXXX runs four characters past the "u"; remember where it began
+                escape_start = i - 1 if ch == "u" else None
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            closers.append("}")
+        elif ch == "[":
+            closers.append("]")
+        elif ch in "}]" and closers:
+            closers.pop()
+
+    if in_string:
+        if escaped:
+            text = text[:-1]
+        elif escape_start is not None and len(text) - escape_start < 6:
+            text = text[:escape_start]
+        text += '"'
+    text = text.rstrip().rstrip(",") + "".join(reversed(closers))
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        # e.g. cut off between a key and its value; the next chunk will fix it
+        return None
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class FlightAbandoned(Exception):
+    """Handed to followers when the leading call was interrupted rather than failed."""
+
+
+class SingleFlight:
+    """Collapses concurrent identical requests into one call to the API.
+
+    Double-clicks and overlapping reruns can issue the same request before the
+    first response reaches the cache; later callers wait on the first one's
+    future instead of paying for a duplicate. Requests without a cache key are
+    sampled and never shared.
+
+    Only ordinary exceptions are shared. Streamlit stops or reruns a session by
+    raising BaseException subclasses inside it, which concern the leader's
+    session alone, so followers of an interrupted leader retry the call instead.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def join(self, key: str) -> tuple[Future, bool]:
+        with self.lock:
+            if key in self.calls:
+                return self.calls[key], False
+            flight = self.calls[key] = Future()
+            return flight, True
+
+    def land(self, key: str, flight: Future, result=None, exception: BaseException | None = None):
+        # Unregister before resolving so a retrying follower can't rejoin a dead flight
+        with self.lock:
+            del self.calls[key]
+        if flight.cancelled():
+            return
+        if exception is None:
+            flight.set_result(result)
+        else:
+            flight.set_exception(exception)
+
+    def crash(self, key: str, flight: Future, exc: BaseException):
+        self.land(key, flight, exception=exc if isinstance(exc, Exception) else FlightAbandoned())
+
+    def do(self, key: str | None, fn):
+        if key is None:
+            return fn()
+        while True:
+            flight, leader = self.join(key)
+            if leader:
+                break
+            try:
+                return flight.result()
+            except FlightAbandoned:
+                continue
+        try:
+            result = fn()
+        except BaseException as exc:
+            self.crash(key, flight, exc)
+            raise
+        self.land(key, flight, result)
+        return result
+
+    async def ado(self, key: str | None, fn):
+        if key is None:
+            return await fn()
+        while True:
+            flight, leader = self.join(key)
+            if leader:
+                break
+            try:
+                # Shielded so cancelling one follower doesn't cancel the shared
+                # future under the leader and every other follower
+                return await asyncio.shield(asyncio.wrap_future(flight))
+            except FlightAbandoned:
+                continue
+        try:
+            result = await fn()
+        except BaseException as exc:
+            self.crash(key, flight, exc)
+            raise
+        self.land(key, flight, result)
+        return result
@@ -0,0 +1,51 @@
+import unittest
+
+from partial_json import parse_partial_json
+
+
+class ParsePartialJsonTest(unittest.TestCase):
+    def test_complete_document(self):
+        self.assertEqual(parse_partial_json('{"a": [1, 2]}'), {"a": [1, 2]})
+
+    def test_no_object_yet(self):
+        self.assertIsNone(parse_partial_json(""))
+        self.assertIsNone(parse_partial_json("Sure, here"))
+
+    def test_skips_leading_prose(self):
+        self.assertEqual(parse_partial_json('Here you go: {"a": 1'), {"a": 1})
+
+    def test_closes_nested_brackets(self):
+        self.assertEqual(
+            parse_partial_json('{"a": {"b": [1, {"c": 2'),
+            {"a": {"b": [1, {"c": 2}]}},
+        )
+
+    def test_open_string_inside_array(self):
+        self.assertEqual(parse_partial_json('{"gaps": ["one", "tw'), {"gaps": ["one", "tw"]})
+
+    def test_trailing_comma(self):
+        self.assertEqual(parse_partial_json('{"gaps": ["one", '), {"gaps": ["one"]})
+        self.assertEqual(parse_partial_json('{"a": 1,\n'), {"a": 1})
+
+    def test_trailing_escape(self):
+        self.assertEqual(parse_partial_json('{"a": "say \\'), {"a": "say "})
+
+    def test_escaped_quote_does_not_close_the_string(self):
+        self.assertEqual(parse_partial_json('{"a": "say \\"hi'), {"a": 'say "hi'})
+
+    def test_escaped_backslash_before_quote(self):
+        self.assertEqual(parse_partial_json('{"a": "c:\\\\", "b": 1'), {"a": "c:\\", "b": 1})
+
+    def test_incomplete_unicode_escape(self):
+        self.assertEqual(parse_partial_json('{"a": "caf\\u00'), {"a": "caf"})
+        self.assertEqual(parse_partial_json('{"a": "caf\\u00e9'), {"a": "café"})
+
+    def test_brackets_inside_strings_are_ignored(self):
+        self.assertEqual(parse_partial_json('{"a": "[{", "b": ['), {"a": "[{", "b": []})
+
+    def test_cut_between_key_and_value(self):
+        self.assertIsNone(parse_partial_json('{"a": 1, "b":'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import unittest
+
+from single_flight import SingleFlight
+
+
+class Interrupted(BaseException):
+    """Stands in for Streamlit's StopException / RerunException."""
+
+
+class ObservedFlight(SingleFlight):
+    """Records followers as they join, so tests can hold the leader until they have."""
+
+    def __init__(self, followers: int = 1):
+        super().__init__()
+        self.expected = followers
+        self.followers = 0
+        self.followed = threading.Event()
+
+    def join(self, key):
+        flight, leader = super().join(key)
+        if not leader:
+            self.followers += 1
+            if self.followers >= self.expected:
+                self.followed.set()
+        return flight, leader
+
+
+class SingleFlightTest(unittest.TestCase):
+    def run_threads(self, flights, fn, count=2):
+        results, errors = [], []
+
+        def call():
+            try:
+                results.append(flights.do("key", fn))
+            except BaseException as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_identical_calls_hit_the_api_once(self):
+        flights = ObservedFlight()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            self.assertTrue(flights.followed.wait(5))
+            return "response"
+
+        results, errors = self.run_threads(flights, fn)
+        self.assertEqual(results, ["response", "response"])
+        self.assertEqual(errors, [])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flights.calls, {})
+
+    def test_errors_are_shared_with_followers(self):
+        flights = ObservedFlight()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            flights.followed.wait(5)
+            raise ValueError("bad response")
+
+        results, errors = self.run_threads(flights, fn)
+        self.assertEqual(results, [])
+        self.assertEqual([type(e) for e in errors], [ValueError, ValueError])
+        self.assertEqual(len(calls), 1)
+
+    def test_interrupted_leader_is_retried_by_followers(self):
+        flights = ObservedFlight()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            if len(calls) == 1:
+                flights.followed.wait(5)
+                raise Interrupted()
+            return "response"
+
+        results, errors = self.run_threads(flights, fn)
+        self.assertEqual(results, ["response"])
+        self.assertEqual([type(e) for e in errors], [Interrupted])
+        self.assertEqual(len(calls), 2)
+
+    def test_calls_without_a_key_are_never_shared(self):
+        flights = SingleFlight()
+        self.assertEqual([flights.do(None, lambda: n) for n in range(2)], [0, 1])
+
+    def test_async_calls_hit_the_api_once(self):
+        calls = []
+
+        async def main():
+            flights = ObservedFlight()
+
+            async def fn():
+                calls.append(1)
+                while not flights.followed.is_set():
+                    await asyncio.sleep(0)
+                return "response"
+
+            return await asyncio.gather(flights.ado("key", fn), flights.ado("key", fn))
+
+        self.assertEqual(asyncio.run(main()), ["response", "response"])
+        self.assertEqual(len(calls), 1)
+
+    def test_cancelling_an_async_follower_leaves_the_flight_intact(self):
+        calls = []
+
+        async def main():
+            flights = ObservedFlight(followers=2)
+            release = asyncio.Event()
+
+            async def fn():
+                calls.append(1)
+                await release.wait()
+                return "response"
+
+            leader = asyncio.create_task(flights.ado("key", fn))
+            cancelled = asyncio.create_task(flights.ado("key", fn))
+            follower = asyncio.create_task(flights.ado("key", fn))
+            while not flights.followed.is_set():
+                await asyncio.sleep(0)
+            cancelled.cancel()
+            await asyncio.sleep(0)
+            release.set()
+            results = await asyncio.gather(leader, follower, cancelled, return_exceptions=True)
+            return results, flights.calls
+
+        (leader, follower, cancelled), pending = asyncio.run(main())
+        self.assertEqual((leader, follower), ("response", "response"))
+        self.assertIsInstance(cancelled, asyncio.CancelledError)
+        self.assertEqual(pending, {})
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
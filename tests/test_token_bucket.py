@@ -0,0 +1,68 @@
+import unittest
+
+from token_bucket import TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        # 60 a minute = 1 token a second keeps the arithmetic readable
+        self.bucket = TokenBucket(60, clock=self.clock)
+
+    def test_starts_full(self):
+        self.assertEqual(self.bucket.reserve(60), 0.0)
+
+    def test_waits_for_the_deficit_at_full_rate(self):
+        self.bucket.reserve(60)
+        self.assertEqual(self.bucket.reserve(5), 5.0)
+
+    def test_refills_over_time_up_to_capacity(self):
+        self.bucket.reserve(60)
+        self.clock.now += 1000
+        self.assertEqual(self.bucket.reserve(60), 0.0)
+        self.assertEqual(self.bucket.reserve(1), 1.0)
+
+    def test_reservation_larger_than_capacity_waits_for_a_full_bucket(self):
+        self.assertEqual(self.bucket.reserve(500), 0.0)
+        self.assertEqual(self.bucket.tokens, 0)
+        self.assertEqual(self.bucket.reserve(500), 60.0)
+
+    def test_penalty_halves_the_refill_rate(self):
+        self.bucket.reserve(60)
+        self.bucket.penalize(100)
+        self.clock.now += 10
+        self.assertEqual(self.bucket.reserve(5), 0.0)
+        self.assertEqual(self.bucket.tokens, 0)
+        self.assertEqual(self.bucket.reserve(5), 10.0)
+
+    def test_refill_after_penalty_expires_mid_interval(self):
+        self.bucket.reserve(60)
+        self.bucket.penalize(10)
+        # 10s at half rate, then 10s at full rate
+        self.clock.now += 20
+        self.assertEqual(self.bucket.reserve(15), 0.0)
+        self.assertEqual(self.bucket.tokens, 0)
+
+    def test_wait_spanning_the_end_of_a_penalty(self):
+        self.bucket.reserve(60)
+        self.bucket.penalize(10)
+        # 5 tokens arrive during the 10s penalty, the other 5 in the next 5s
+        self.assertEqual(self.bucket.reserve(10), 15.0)
+
+    def test_penalty_does_not_slow_tokens_already_earned(self):
+        self.bucket.reserve(60)
+        self.clock.now += 10
+        self.bucket.penalize(100)
+        self.assertEqual(self.bucket.reserve(10), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
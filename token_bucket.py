@@ -0,0 +1,56 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at ``per_minute`` tokens a minute.
+
+    ``reserve`` deducts the tokens up front and returns how long the caller has
+    to wait before sending, so bursts are paced just under the limit instead of
+    being sent, rejected with a 429 and retried blind. After ``penalize`` the
+    bucket refills at half rate for a while (multiplicative decrease).
+    """
+
+    def __init__(self, per_minute: float, clock=time.monotonic):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.clock = clock
+        self.updated = clock()
+        self.throttled_until = self.updated
+        self.lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / 60
+
+    def refill(self, now: float):
+        # Time before throttled_until counts at half rate, the rest at full rate
+        throttled = max(0.0, min(now, self.throttled_until) - self.updated)
+        full = (now - self.updated) - throttled
+        gained = throttled * self.rate / 2 + full * self.rate
+        self.tokens = min(self.capacity, self.tokens + gained)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        # Seconds until the balance climbs back to zero at the scheduled rates
+        deficit = -self.tokens
+        if deficit <= 0:
+            return 0.0
+        throttled = max(0.0, self.throttled_until - now)
+        if deficit <= throttled * self.rate / 2:
+            return deficit / (self.rate / 2)
+        return throttled + (deficit - throttled * self.rate / 2) / self.rate
+
+    def reserve(self, amount: float) -> float:
+        with self.lock:
+            now = self.clock()
+            self.refill(now)
+            # A single request larger than the bucket waits for a full bucket
+            self.tokens -= min(amount, self.capacity)
+            return self.wait_time(now)
+
+    def penalize(self, seconds: float):
+        with self.lock:
+            now = self.clock()
+            self.refill(now)
+            self.throttled_until = max(self.throttled_until, now + seconds)